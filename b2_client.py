@@ -0,0 +1,35 @@
+"""
+Process-wide Backblaze B2 handle for long-running callers such as server.py.
+
+The standalone scripts authorize on every run; the server instead authorizes
+once and reuses the same B2Api (and its pooled HTTP sessions) for every
+request. b2sdk re-authorizes on its own when the account token expires.
+"""
+
+import os
+import threading
+from typing import Dict, Optional
+
+from backup_to_b2 import ensure_bucket, init_b2
+from restore_from_b2 import get_restore_workers
+
+_API = None
+_BUCKETS: Dict[str, object] = {}
+_LOCK = threading.Lock()
+
+
+def get_bucket(bucket_name: Optional[str] = None):
+    """Return the bucket (default B2_BUCKET_NAME), authorizing against B2 on first use only."""
+    global _API
+    bucket_name = bucket_name or os.getenv("B2_BUCKET_NAME")
+    if not bucket_name:
+        raise ValueError("B2_BUCKET_NAME is not set.")
+
+    with _LOCK:
+        if _API is None:
+            # The handle serves /restore downloads as well as uploads
+            _API = init_b2(http_pool_size=get_restore_workers())
+        bucket = _BUCKETS.get(bucket_name)
+        if bucket is None:
+            bucket = _BUCKETS[bucket_name] = ensure_bucket(_API, bucket_name)
+    return bucket
@@ -1,20 +1,82 @@
+import atexit
+import functools
 import hashlib
 import logging
 import mimetypes
+import mmap
 import os
+import queue
+import re
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
 
+import orjson
+import requests
 from dotenv import load_dotenv
-from b2sdk.v2 import InMemoryAccountInfo, B2Api, UploadSourceLocalFile
+from requests.adapters import HTTPAdapter
+from b2sdk.v2 import B2HttpApiConfig, InMemoryAccountInfo, B2Api, UploadSourceBytes, UploadSourceLocalFile
+
+try:
+    import blake3
+except ImportError:  # optional, only needed for B2_HASH_ALGORITHM=blake3
+    blake3 = None
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for B2_COMPRESS_TEXT=true
+    zstandard = None
+
+
+# Files below this size go to the small-file queue and are submitted first,
+# so they don't wait behind multi-megabyte uploads.
+SMALL_FILE_THRESHOLD = 1 << 20
+
+# Read size for the pre-3.11 hashing fallback.
+HASH_CHUNK_SIZE = 1 << 20
+
+# Files up to this size are memory-mapped and hashed/uploaded from one buffer.
+MMAP_MAX_SIZE = 64 << 20
+
+# Per-file messages are logged at DEBUG; INFO gets a progress line every N files
+PROGRESS_LOG_INTERVAL = 100
+
+# Integrity hashes stored in file_info under the algorithm's name
+HASH_ALGORITHMS = ("sha256", "blake3")
+
+# Files below this size are pre-hashed PREHASH_BATCH_SIZE at a time per task
+PREHASH_SMALL_FILE_SIZE = 64 << 10
+PREHASH_BATCH_SIZE = 8
+
+# Text assets that are zstd-compressed before upload when B2_COMPRESS_TEXT is on
+COMPRESSIBLE_TYPES = {
+    "text/html",
+    "text/css",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+}
+PRECOMPRESSED_SUFFIXES = (".gz", ".br", ".zst")
+ZSTD_LEVEL = 19
 
 
 def configure_logging() -> None:
+    # Records are written by a listener thread so worker threads never block on stderr
+    log_queue = queue.Queue(-1)
+    # The QueueHandler formats each record; the listener's handler writes it as-is
+    listener = QueueListener(log_queue, logging.StreamHandler())
+    listener.start()
+    atexit.register(listener.stop)
     logging.basicConfig(
         level=logging.INFO,
         format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[QueueHandler(log_queue)],
     )
 
 
@@ -31,7 +93,24 @@ def get_env(name: str, default: Optional[str] = None, required: bool = False) ->
     return value
 
 
-def init_b2(app_key_id: Optional[str] = None, app_key: Optional[str] = None) -> B2Api:
+def make_http_session_factory(pool_size: int):
+    """Return a factory for keep-alive sessions whose pool fits pool_size concurrent requests"""
+    def factory() -> requests.Session:
+        session = requests.Session()
+        # b2sdk retries on its own, so the adapter must not
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=pool_size, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+    return factory
+
+
+def init_b2(app_key_id: Optional[str] = None, app_key: Optional[str] = None, http_pool_size: int = 0) -> B2Api:
+    """
+    Authorize a B2Api sized for concurrent uploads. Pass http_pool_size when
+    the same handle also serves that many concurrent requests of another kind
+    (e.g. restore downloads), so the connection pool is never the bottleneck.
+    """
     app_key_id = app_key_id or os.getenv("B2_APPLICATION_KEY_ID")
     app_key = app_key or os.getenv("B2_APPLICATION_KEY")
     if not app_key_id:
@@ -39,7 +118,17 @@ def init_b2(app_key_id: Optional[str] = None, app_key: Optional[str] = None) ->
     if not app_key:
         raise ValueError("B2_APPLICATION_KEY is not set.")
     info = InMemoryAccountInfo()
-    b2_api = B2Api(info)
+    # b2sdk runs every upload (small files and large-file parts) on this pool,
+    # so size it for our concurrent file uploads plus the large-file parts.
+    upload_workers = max(1, int(os.getenv("B2_UPLOAD_WORKERS", "8")))
+    large_workers = max(1, int(os.getenv("B2_LARGE_WORKERS", "4")))
+    max_upload_workers = upload_workers + large_workers
+    pool_size = max(max_upload_workers, http_pool_size)
+    b2_api = B2Api(
+        info,
+        max_upload_workers=max_upload_workers,
+        api_config=B2HttpApiConfig(http_session_factory=make_http_session_factory(pool_size)),
+    )
     logging.info("Authorizing against Backblaze B2...")
     b2_api.authorize_account("production", app_key_id, app_key)
     logging.info("Authorization successful.")
@@ -57,40 +146,387 @@ def ensure_bucket(b2_api: B2Api, bucket_name: str):
         raise
 
 
-def guess_content_type(path: Path) -> Optional[str]:
-    ctype, _ = mimetypes.guess_type(str(path))
+@functools.lru_cache(maxsize=64)
+def _guess_by_ext(suffix: str) -> Optional[str]:
+    ctype, _ = mimetypes.guess_type("file" + suffix)
     return ctype
 
 
-def calculate_file_hash(file_path: Path) -> str:
-    """Calculate SHA256 hash of a file"""
-    sha256_hash = hashlib.sha256()
+def guess_content_type(path: Path) -> Optional[str]:
+    suffix = path.suffix.lower()
+    if suffix in mimetypes.encodings_map or suffix in mimetypes.suffix_map:
+        # Compound suffixes like .tar.gz / .tgz need the full name
+        ctype, _ = mimetypes.guess_type(str(path))
+        return ctype
+    return _guess_by_ext(suffix)
+
+
+def get_hash_algorithm() -> str:
+    """Return the integrity hash algorithm selected by B2_HASH_ALGORITHM (default sha256)"""
+    algorithm = (os.getenv("B2_HASH_ALGORITHM") or "sha256").strip().lower()
+    if algorithm not in HASH_ALGORITHMS:
+        raise ValueError(f"Unsupported B2_HASH_ALGORITHM '{algorithm}'. Use one of: {', '.join(HASH_ALGORITHMS)}.")
+    if algorithm == "blake3" and blake3 is None:
+        raise ValueError("B2_HASH_ALGORITHM=blake3 requires the blake3 package - install with: pip install blake3")
+    return algorithm
+
+
+def get_compress_text() -> bool:
+    """Whether B2_COMPRESS_TEXT asks for zstd pre-compression of text assets"""
+    enabled = (os.getenv("B2_COMPRESS_TEXT") or "").strip().lower() in ("1", "true", "yes", "on")
+    if enabled and zstandard is None:
+        raise ValueError("B2_COMPRESS_TEXT requires the zstandard package - install with: pip install zstandard")
+    return enabled
+
+
+def is_compressible(local_path: Path, content_type: Optional[str], file_size: int) -> bool:
+    return (
+        content_type in COMPRESSIBLE_TYPES
+        and local_path.suffix.lower() not in PRECOMPRESSED_SUFFIXES
+        and 0 < file_size <= MMAP_MAX_SIZE
+    )
+
+
+def compress_buffer(data) -> bytes:
+    """Compress a bytes-like object (e.g. the file's mmap) with zstd, using all cores for large inputs"""
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=-1).compress(data)
+
+
+def hash_buffer(data, algorithm: str = "sha256") -> str:
+    """Hash a bytes-like object (bytes, mmap, memoryview)"""
+    if algorithm == "blake3":
+        return blake3.blake3(data, max_threads=blake3.blake3.AUTO).hexdigest()
+    return hashlib.sha256(data).hexdigest()
+
+
+def load_hash_cache(cache_path: Path) -> Dict[str, Dict]:
+    """Load the {abs_path: {mtime_ns, size, <algorithm>: digest}} sidecar, or {} if missing/corrupt"""
+    try:
+        cache = orjson.loads(cache_path.read_bytes())
+        return cache if isinstance(cache, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except Exception as exc:
+        logging.warning("Ignoring unreadable hash cache %s: %s", cache_path, exc)
+        return {}
+
+
+# Temp files of atomic writes are named .{name}.{pid}.{thread id}.atomic-tmp;
+# the backup scan skips exactly this shape, never other user files
+_ATOMIC_TMP_RE = re.compile(r"\..+\.\d+\.\d+\.atomic-tmp")
+
+
+def is_atomic_tmp_name(name: str) -> bool:
+    return _ATOMIC_TMP_RE.fullmatch(name) is not None
+
+
+@contextmanager
+def atomic_replace(path: Path) -> Iterator[Path]:
+    """
+    Yield a sibling temp path to write, then rename it over path.
+
+    Readers see either the old or the new file, never a truncated one. The
+    temp name is per thread so concurrent writers don't share a file; it is
+    removed if writing fails.
+    """
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.atomic-tmp")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """Atomically replace path with data"""
+    with atomic_replace(path) as tmp_path:
+        tmp_path.write_bytes(data)
+
+
+def save_hash_cache(cache_path: Path, cache: Dict[str, Dict]) -> None:
+    """Atomically write the hash cache sidecar"""
+    atomic_write_bytes(cache_path, orjson.dumps(cache))
+
+
+def _cache_key(file_path: Path) -> str:
+    return os.path.abspath(file_path)
+
+
+def _cached_hash(cache: Optional[Dict[str, Dict]], file_path: Path, st: os.stat_result, algorithm: str = "sha256") -> Optional[str]:
+    if cache is None:
+        return None
+    entry = cache.get(_cache_key(file_path))
+    if entry and entry.get("mtime_ns") == st.st_mtime_ns and entry.get("size") == st.st_size:
+        return entry.get(algorithm)
+    return None
+
+
+def _store_hash(cache: Optional[Dict[str, Dict]], file_path: Path, st: os.stat_result, file_hash: str, algorithm: str = "sha256") -> None:
+    if cache is None:
+        return
+    key = _cache_key(file_path)
+    entry = cache.get(key)
+    if not entry or entry.get("mtime_ns") != st.st_mtime_ns or entry.get("size") != st.st_size:
+        entry = {"mtime_ns": st.st_mtime_ns, "size": st.st_size}
+        cache[key] = entry
+    entry[algorithm] = file_hash
+
+
+def calculate_file_hash(file_path: Path, cache: Optional[Dict[str, Dict]] = None, st: Optional[os.stat_result] = None, algorithm: str = "sha256") -> str:
+    """Calculate the hash of a file, reusing the cached digest if mtime and size are unchanged"""
+    st = st or os.stat(file_path)
+    cached = _cached_hash(cache, file_path, st, algorithm)
+    if cached:
+        return cached
+    if algorithm == "blake3":
+        # Memory-maps the file and hashes it with SIMD, using multiple threads for large inputs
+        hasher = blake3.blake3(max_threads=blake3.blake3.AUTO)
+        hasher.update_mmap(file_path)
+        file_hash = hasher.hexdigest()
+        _store_hash(cache, file_path, st, file_hash, algorithm)
+        return file_hash
     with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(chunk)
-    return sha256_hash.hexdigest()
+        if hasattr(hashlib, "file_digest"):
+            # Python 3.11+: the read/update loop runs in C
+            file_hash = hashlib.file_digest(f, "sha256").hexdigest()
+        else:
+            sha256_hash = hashlib.sha256()
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                sha256_hash.update(chunk)
+            file_hash = sha256_hash.hexdigest()
+    _store_hash(cache, file_path, st, file_hash, algorithm)
+    return file_hash
+
+
+def calculate_file_hash_and_sha1(file_path: Path, algorithm: str = "sha256") -> Tuple[str, str]:
+    """Compute the integrity hash and B2's content SHA1 in a single read of the file"""
+    hasher = blake3.blake3(max_threads=blake3.blake3.AUTO) if algorithm == "blake3" else hashlib.sha256()
+    sha1_hash = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+            sha1_hash.update(chunk)
+    return hasher.hexdigest(), sha1_hash.hexdigest()
+
 
-def upload_file_with_retry(bucket, local_path: Path, b2_name: str, content_type: str, max_retries: int = 3) -> bool:
-    """Upload a single file with retry logic"""
+@contextmanager
+def open_upload_source(
+    local_path: Path,
+    hash_cache: Optional[Dict[str, Dict]] = None,
+    st: Optional[os.stat_result] = None,
+    algorithm: str = "sha256",
+) -> Iterator[Tuple[object, str, Optional[str], Optional[object]]]:
+    """
+    Yield (upload_source, file_hash, content_sha1, data) for local_path.
+
+    Files up to MMAP_MAX_SIZE are memory-mapped once and the same buffer is
+    hashed and uploaded, so the file is only read from disk a single time.
+    Larger files keep streaming from disk via UploadSourceLocalFile; their
+    SHA1 (required by B2) is computed in the same pass as the integrity hash
+    so b2sdk doesn't read the whole file again just to checksum it.
+    content_sha1 is None when b2sdk should compute it itself. data is the
+    in-memory buffer (the mmap) behind upload_source, or None when streaming.
+    """
+    st = st or local_path.stat()
+    if st.st_size == 0:
+        yield UploadSourceBytes(b""), hash_buffer(b"", algorithm), None, b""
+    elif st.st_size <= MMAP_MAX_SIZE:
+        with open(local_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            file_hash = _cached_hash(hash_cache, local_path, st, algorithm)
+            if not file_hash:
+                file_hash = hash_buffer(mapped, algorithm)
+                _store_hash(hash_cache, local_path, st, file_hash, algorithm)
+            yield UploadSourceBytes(mapped), file_hash, None, mapped
+    else:
+        file_hash = _cached_hash(hash_cache, local_path, st, algorithm)
+        content_sha1 = _cached_hash(hash_cache, local_path, st, "sha1")
+        if not file_hash or not content_sha1:
+            file_hash, content_sha1 = calculate_file_hash_and_sha1(local_path, algorithm)
+            _store_hash(hash_cache, local_path, st, file_hash, algorithm)
+            _store_hash(hash_cache, local_path, st, content_sha1, "sha1")
+        yield UploadSourceLocalFile(local_path, content_sha1=content_sha1), file_hash, content_sha1, None
+
+
+def list_remote_hashes(bucket, prefix: str, algorithm: str = "sha256") -> Dict[str, str]:
+    """Return {b2_name: digest} for the latest versions under prefix that carry an `algorithm` file_info"""
+    remote_hashes = {}
+    for file_version, _ in bucket.ls(prefix.rstrip("/"), latest_only=True, recursive=True):
+        file_hash = (file_version.file_info or {}).get(algorithm)
+        if file_hash:
+            remote_hashes[file_version.file_name] = file_hash
+    return remote_hashes
+
+
+def _hash_batch(batch: List[Tuple[Path, os.stat_result]], hash_cache: Dict[str, Dict], algorithm: str) -> None:
+    for local_path, st in batch:
+        if st.st_size > MMAP_MAX_SIZE:
+            # Streamed on upload: cache the SHA1 from the same pass so a changed
+            # file isn't read again by b2sdk just to checksum it
+            file_hash, content_sha1 = calculate_file_hash_and_sha1(local_path, algorithm)
+            _store_hash(hash_cache, local_path, st, file_hash, algorithm)
+            _store_hash(hash_cache, local_path, st, content_sha1, "sha1")
+        else:
+            calculate_file_hash(local_path, hash_cache, st, algorithm)
+
+
+def advise_willneed(paths: List[Path]) -> None:
+    """
+    Ask the kernel to start reading paths into the page cache asynchronously
+    (posix_fadvise WILLNEED), so disk reads run ahead of hashing/uploading.
+    No-op where posix_fadvise is unavailable (Windows, macOS).
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+def prehash_files(executor: ThreadPoolExecutor, jobs, hash_cache: Dict[str, Dict], remote_hashes: Dict[str, str], algorithm: str) -> None:
+    """
+    Hash, in parallel, the uncached files that already exist remotely, so the
+    upload stage can skip unchanged ones without opening them.
+
+    Files without a remote copy are left alone: they must be uploaded anyway
+    and are hashed from the same mmap that feeds the upload. Small files are
+    hashed in batches per task so dispatch overhead doesn't dominate.
+    """
+    small_batch = []
+    batches = []
+    for local_path, b2_name, _, st in jobs:
+        if b2_name not in remote_hashes or _cached_hash(hash_cache, local_path, st, algorithm):
+            continue
+        if st.st_size < PREHASH_SMALL_FILE_SIZE:
+            small_batch.append((local_path, st))
+            if len(small_batch) == PREHASH_BATCH_SIZE:
+                batches.append(small_batch)
+                small_batch = []
+        else:
+            batches.append([(local_path, st)])
+    if small_batch:
+        batches.append(small_batch)
+
+    futures = [executor.submit(_hash_batch, batch, hash_cache, algorithm) for batch in batches]
+    for future in as_completed(futures):
+        try:
+            future.result()
+        except Exception as exc:
+            # The upload stage will hash (and report) the file again
+            logging.warning("Pre-hash failed: %s", exc)
+
+
+def upload_file_with_retry(
+    bucket,
+    local_path: Path,
+    b2_name: str,
+    content_type: str,
+    *,
+    max_retries: int = 3,
+    hash_cache: Optional[Dict[str, Dict]] = None,
+    remote_hashes: Optional[Dict[str, str]] = None,
+    st: Optional[os.stat_result] = None,
+    algorithm: str = "sha256",
+    compress: bool = False,
+) -> bool:
+    """
+    Upload a single file with retry logic.
+
+    Returns False without uploading when remote_hashes shows B2 already holds
+    identical content under b2_name. With compress, text assets are uploaded
+    zstd-compressed and tagged with file_info content-encoding=zstd; the stored
+    hash is always that of the original file.
+    """
+    st = st or local_path.stat()
+    remote_hash = remote_hashes.get(b2_name) if remote_hashes else None
+    if remote_hash and remote_hash == _cached_hash(hash_cache, local_path, st, algorithm):
+        logging.debug("Skipping %s (unchanged)", local_path)
+        return False
+    if st.st_size >= SMALL_FILE_THRESHOLD:
+        # Start readahead right before this worker reads the file, so at most
+        # one file per worker is being prefetched and nothing is evicted early
+        advise_willneed([local_path])
+    with open_upload_source(local_path, hash_cache, st, algorithm) as (upload_source, file_hash, content_sha1, data):
+        if remote_hash == file_hash:
+            logging.debug("Skipping %s (unchanged)", local_path)
+            return False
+        content_encoding = None
+        if compress and data is not None and is_compressible(local_path, content_type, st.st_size):
+            # Compress the buffer that was just hashed instead of reading the file again
+            upload_source = UploadSourceBytes(compress_buffer(data))
+            content_encoding = "zstd"
+        return _upload_source_with_retry(
+            bucket,
+            upload_source,
+            local_path=local_path,
+            b2_name=b2_name,
+            content_type=content_type,
+            file_size=st.st_size,
+            file_hash=file_hash,
+            algorithm=algorithm,
+            content_sha1=content_sha1,
+            content_encoding=content_encoding,
+            max_retries=max_retries,
+        )
+
+
+def _upload_source_with_retry(
+    bucket,
+    upload_source,
+    *,
+    local_path: Path,
+    b2_name: str,
+    content_type: str,
+    file_size: int,
+    file_hash: str,
+    algorithm: str,
+    content_sha1: Optional[str] = None,
+    content_encoding: Optional[str] = None,
+    max_retries: int = 3,
+) -> bool:
+    account_info = bucket.api.account_info
+    large_file = (
+        isinstance(upload_source, UploadSourceLocalFile)
+        and file_size >= account_info.get_recommended_part_size()
+    )
     for attempt in range(max_retries):
         try:
-            logging.info("Uploading %s -> b2://%s/%s (attempt %d/%d)", local_path, bucket.name, b2_name, attempt + 1, max_retries)
-            
-            # Calculate file hash for integrity verification
-            file_hash = calculate_file_hash(local_path)
+            logging.debug("Uploading %s -> b2://%s/%s (attempt %d/%d)", local_path, bucket.name, b2_name, attempt + 1, max_retries)
             
+            # File hash is used for integrity verification
             file_info = {
-                'sha256': file_hash,
+                algorithm: file_hash,
                 'upload_timestamp': str(int(time.time()))
             }
+            if content_encoding:
+                file_info['content-encoding'] = content_encoding
             
-            bucket.upload(
-                UploadSourceLocalFile(local_path),
-                file_name=b2_name,
-                content_type=content_type,
-                file_info=file_info
-            )
-            logging.info("Successfully uploaded %s (SHA256: %s)", local_path, file_hash[:8])
+            if large_file:
+                # Large-file API: parts are uploaded concurrently on b2sdk's upload pool
+                bucket.upload_local_file(
+                    local_file=str(local_path),
+                    file_name=b2_name,
+                    content_type=content_type,
+                    file_info=file_info,
+                    sha1_sum=content_sha1,
+                    min_part_size=account_info.get_absolute_minimum_part_size(),
+                )
+            else:
+                bucket.upload(
+                    upload_source,
+                    file_name=b2_name,
+                    content_type=content_type,
+                    file_info=file_info
+                )
+            logging.debug("Successfully uploaded %s (%s: %s)", local_path, algorithm.upper(), file_hash[:8])
             return True
         except Exception as exc:
             logging.warning("Upload attempt %d failed for %s: %s", attempt + 1, local_path, exc)
@@ -100,44 +536,146 @@ def upload_file_with_retry(bucket, local_path: Path, b2_name: str, content_type:
             time.sleep(2 ** attempt)  # Exponential backoff
     return False
 
-def upload_directory_to_b2(site_dir: Path, bucket, prefix: str) -> int:
-    """Upload directory to B2 with retry logic and integrity checks"""
+def iter_site_files(directory: str) -> Iterator[os.DirEntry]:
+    """
+    Recursively yield DirEntry objects for files under directory (directory
+    symlinks are not followed). In-flight atomic_replace temp files are
+    skipped; they are renamed away at any moment and must not be backed up.
+    """
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_site_files(entry.path)
+            elif is_atomic_tmp_name(entry.name):
+                continue
+            elif entry.is_file():
+                yield entry
+
+
+def collect_upload_jobs(site_dir: Path, prefix: str) -> List[Tuple[Path, str, Optional[str], os.stat_result]]:
+    """Scan site_dir and return (local_path, b2_name, content_type, stat) tuples, small files first"""
+    small_files = []
+    large_files = []
+    # entry.path always starts with the scanned directory, so the relative
+    # path is a plain slice rather than a Path.relative_to() per file
+    site_dir_str = str(site_dir).rstrip(os.sep) + os.sep
+    for entry in iter_site_files(str(site_dir)):
+        local_path = Path(entry.path)
+        rel_path = entry.path[len(site_dir_str):].replace(os.sep, "/")
+        b2_name = f"{prefix}/{rel_path}"
+        content_type = guess_content_type(local_path)
+        # DirEntry caches the stat result; it is reused for hashing and upload
+        try:
+            st = entry.stat()
+        except FileNotFoundError:
+            # Removed or renamed while scanning
+            continue
+        job = (local_path, b2_name, content_type, st)
+        if st.st_size < SMALL_FILE_THRESHOLD:
+            small_files.append(job)
+        else:
+            large_files.append(job)
+    return small_files + large_files
+
+
+class BackupResult(NamedTuple):
+    """Files uploaded by a backup run, and files skipped because B2 already had them"""
+    uploaded: int
+    unchanged: int
+
+    @property
+    def total(self) -> int:
+        """Number of site files now backed up in the bucket"""
+        return self.uploaded + self.unchanged
+
+
+# One directory upload at a time per process. Runs started by overlapping
+# server requests would otherwise both upload the same changed files and race
+# on the hash cache; each run is already parallel internally.
+_UPLOAD_RUN_LOCK = threading.Lock()
+
+
+def upload_directory_to_b2(site_dir: Path, bucket, prefix: str) -> BackupResult:
+    """
+    Upload directory to B2 concurrently with retry logic and integrity checks.
+
+    Files whose hash matches the latest version already in the bucket are
+    skipped. Returns the uploaded and unchanged file counts.
+    """
+    if not _UPLOAD_RUN_LOCK.acquire(blocking=False):
+        logging.info("Another backup is in progress; waiting for it to finish...")
+        _UPLOAD_RUN_LOCK.acquire()
+    try:
+        return _upload_directory_to_b2(site_dir, bucket, prefix)
+    finally:
+        _UPLOAD_RUN_LOCK.release()
+
+
+def _upload_directory_to_b2(site_dir: Path, bucket, prefix: str) -> BackupResult:
     total_files = 0
+    skipped_files = 0
     failed_files = []
-    
-    for root, _, files in os.walk(site_dir):
-        for filename in files:
-            local_path = Path(root) / filename
-            rel_path = local_path.relative_to(site_dir).as_posix()
-            b2_name = f"{prefix}/{rel_path}".replace("\\", "/")
-            content_type = guess_content_type(local_path)
-            
+
+    # The pool size also bounds how many files are open at once.
+    max_workers = max(1, int(os.getenv("B2_UPLOAD_WORKERS", "8")))
+    algorithm = get_hash_algorithm()
+    compress = get_compress_text()
+    cache_path = Path(os.getenv("B2_HASH_CACHE", ".b2_hash_cache.json"))
+    hash_cache = load_hash_cache(cache_path)
+    jobs = collect_upload_jobs(site_dir, prefix)
+    try:
+        remote_hashes = list_remote_hashes(bucket, prefix, algorithm)
+    except Exception as exc:
+        logging.warning("Could not list existing backup, uploading all files: %s", exc)
+        remote_hashes = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        prehash_files(executor, jobs, hash_cache, remote_hashes, algorithm)
+        futures = {
+            executor.submit(
+                upload_file_with_retry, bucket, local_path, b2_name, content_type,
+                hash_cache=hash_cache, remote_hashes=remote_hashes, st=st, algorithm=algorithm, compress=compress,
+            ): local_path
+            for local_path, b2_name, content_type, st in jobs
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            local_path = futures[future]
             try:
-                if upload_file_with_retry(bucket, local_path, b2_name, content_type):
+                if future.result():
                     total_files += 1
                 else:
-                    failed_files.append(str(local_path))
+                    skipped_files += 1
             except Exception as exc:
                 logging.error("Failed to upload %s: %s", local_path, exc)
                 failed_files.append(str(local_path))
+            if done % PROGRESS_LOG_INTERVAL == 0:
+                logging.info("Processed %d/%d files", done, len(jobs))
+
+    # Keep only entries for files that still exist in the site
+    live_keys = {_cache_key(local_path) for local_path, _, _, _ in jobs}
+    try:
+        save_hash_cache(cache_path, {k: v for k, v in hash_cache.items() if k in live_keys})
+    except Exception as exc:
+        logging.warning("Failed to save hash cache %s: %s", cache_path, exc)
     
     if failed_files:
         logging.error("Failed to upload %d files: %s", len(failed_files), failed_files)
         raise RuntimeError(f"Upload incomplete. {len(failed_files)} files failed.")
     
-    if total_files == 0:
+    if not jobs:
         logging.warning("No files found in %s to upload.", site_dir)
     else:
-        logging.info("Upload complete. %d files uploaded successfully.", total_files)
+        logging.info("Upload complete. %d files uploaded successfully, %d unchanged.", total_files, skipped_files)
     
-    return total_files
+    return BackupResult(total_files, skipped_files)
 
 
-def backup_site_to_b2(*, load_env_vars: bool = True) -> int:
+def backup_site_to_b2(*, load_env_vars: bool = True, bucket=None) -> BackupResult:
     """
     Perform the site backup to Backblaze B2.
 
-    Returns the number of files uploaded.
+    Pass an already authorized bucket (see b2_client.get_bucket) to skip
+    authorizing again. Returns the uploaded and unchanged file counts.
     """
     if load_env_vars:
         load_env()
@@ -146,22 +684,22 @@ def backup_site_to_b2(*, load_env_vars: bool = True) -> int:
     if not site_dir.exists() or not site_dir.is_dir():
         raise FileNotFoundError(f"Site directory '{site_dir}' does not exist.")
 
-    bucket_name = os.getenv("B2_BUCKET_NAME")
-    if not bucket_name:
-        raise ValueError("B2_BUCKET_NAME is not set.")
-
     prefix = os.getenv("B2_PREFIX", "docs")
 
-    b2_api = init_b2()
-    bucket = ensure_bucket(b2_api, bucket_name)
+    if bucket is None:
+        bucket_name = os.getenv("B2_BUCKET_NAME")
+        if not bucket_name:
+            raise ValueError("B2_BUCKET_NAME is not set.")
+        b2_api = init_b2()
+        bucket = ensure_bucket(b2_api, bucket_name)
     return upload_directory_to_b2(site_dir, bucket, prefix)
 
 
 def main() -> None:
     configure_logging()
     try:
-        files_uploaded = backup_site_to_b2(load_env_vars=True)
-        logging.info("Backup finished. %d files uploaded.", files_uploaded)
+        result = backup_site_to_b2(load_env_vars=True)
+        logging.info("Backup finished. %d files uploaded, %d unchanged.", result.uploaded, result.unchanged)
     except FileNotFoundError as exc:
         logging.error("%s", exc)
         sys.exit(2)
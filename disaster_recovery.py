@@ -4,17 +4,17 @@ Comprehensive Disaster Recovery Script
 Handles complete system recovery from Backblaze B2 backups
 """
 
-import json
 import logging
+import os
 import shutil
-import subprocess
 import sys
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Set
 
+import orjson
 from dotenv import load_dotenv
-from restore_from_b2 import init_b2, ensure_bucket, restore_prefix_to_local, get_env
+from restore_from_b2 import init_b2, ensure_bucket, restore_prefix_to_local, get_env, run_git_commands
 
 # Configure logging
 logging.basicConfig(
@@ -32,18 +32,20 @@ def create_recovery_report(recovery_path: Path, files_restored: int, start_time:
     duration = (end_time - start_time).total_seconds()
     
     report = {
-        "recovery_timestamp": end_time.isoformat() + "Z",
+        "recovery_timestamp": end_time,
         "recovery_duration_seconds": duration,
         "files_restored": files_restored,
         "recovery_path": str(recovery_path),
         "status": "completed",
-        "start_time": start_time.isoformat() + "Z",
-        "end_time": end_time.isoformat() + "Z"
+        "start_time": start_time,
+        "end_time": end_time
     }
     
+    # Naive UTC datetimes are serialized by orjson as ISO 8601 with a "Z" suffix
     report_path = Path("recovery_report.json")
-    with open(report_path, "w") as f:
-        json.dump(report, f, indent=2)
+    report_path.write_bytes(
+        orjson.dumps(report, option=orjson.OPT_INDENT_2 | orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z)
+    )
     
     logging.info(f"Recovery report saved to {report_path}")
     
@@ -57,6 +59,22 @@ def create_recovery_report(recovery_path: Path, files_restored: int, start_time:
     print(f"Report saved: {report_path}")
     print(f"{'='*50}\n")
 
+def list_relative_files(root: Path) -> Set[str]:
+    """Return the POSIX-style paths of all files under root, relative to root"""
+    found = set()
+
+    def scan(directory: str, rel_prefix: str) -> None:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    scan(entry.path, f"{rel_prefix}{entry.name}/")
+                elif entry.is_file():
+                    found.add(f"{rel_prefix}{entry.name}")
+
+    if root.is_dir():
+        scan(str(root), "")
+    return found
+
 def verify_recovery(recovery_path: Path) -> bool:
     """Verify that recovery was successful"""
     logging.info("Verifying recovery...")
@@ -69,11 +87,8 @@ def verify_recovery(recovery_path: Path) -> bool:
         "js/main.js"
     ]
     
-    missing_files = []
-    for file_path in essential_files:
-        full_path = recovery_path / file_path
-        if not full_path.exists():
-            missing_files.append(file_path)
+    present_files = list_relative_files(recovery_path)
+    missing_files = [file_path for file_path in essential_files if file_path not in present_files]
     
     if missing_files:
         logging.error(f"Recovery verification failed. Missing files: {missing_files}")
@@ -82,8 +97,7 @@ def verify_recovery(recovery_path: Path) -> bool:
     # Check content.json is valid JSON
     try:
         content_path = recovery_path / "data" / "content.json"
-        with open(content_path, "r") as f:
-            json.load(f)
+        orjson.loads(content_path.read_bytes())
         logging.info("content.json is valid JSON")
     except Exception as e:
         logging.error(f"content.json validation failed: {e}")
@@ -172,14 +186,12 @@ def main():
         
         if git_remote and git_branch:
             print(f"\n🔄 Step 7: Deploying to {git_remote}/{git_branch}...")
-            try:
-                subprocess.run(["git", "add", str(site_dir)], check=True, capture_output=True)
-                commit_message = f"Disaster recovery completed on {datetime.utcnow().isoformat()}Z"
-                subprocess.run(["git", "commit", "-m", commit_message], check=True, capture_output=True)
-                subprocess.run(["git", "push", git_remote, git_branch], check=True, capture_output=True)
+            commit_message = f"Disaster recovery completed on {datetime.utcnow().isoformat()}Z"
+            code, msg = run_git_commands(site_dir, git_remote, git_branch, commit_message)
+            if code == 0:
                 logging.info("✅ Successfully deployed to git repository")
-            except subprocess.CalledProcessError as e:
-                logging.warning(f"Git deployment failed: {e}")
+            else:
+                logging.warning(f"Git deployment failed: {msg}")
                 print("⚠️  Git deployment failed - manual push may be required")
         
         print("\n🎉 DISASTER RECOVERY SUCCESSFUL!")
@@ -2,18 +2,24 @@
 """
 Backup monitoring and alerting system
 Checks backup health and sends notifications if issues are detected
+
+Run once (e.g. from cron):   python monitor_backups.py
+Run as a long-lived daemon:  python monitor_backups.py --watch
 """
 
-import json
+import argparse
 import logging
 import smtplib
 import sys
+import threading
+import time
 from datetime import datetime, timedelta
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from pathlib import Path
 from typing import Dict, Optional
 
+import orjson
 from dotenv import load_dotenv
 import os
 
@@ -27,20 +33,22 @@ logging.basicConfig(
     ]
 )
 
+METRICS_PATH = Path("metrics.json")
+
+
 def load_metrics() -> Dict:
     """Load backup metrics from metrics.json"""
-    metrics_path = Path("metrics.json")
+    metrics_path = METRICS_PATH
     if not metrics_path.exists():
         return {}
     
     try:
-        with open(metrics_path, "r") as f:
-            return json.load(f)
+        return orjson.loads(metrics_path.read_bytes())
     except Exception as e:
         logging.error(f"Failed to load metrics: {e}")
         return {}
 
-def check_backup_health(metrics: Dict) -> Dict:
+def check_backup_health(metrics: Dict, max_backup_age_hours: float = 48) -> Dict:
     """Check backup health and return status"""
     now = datetime.utcnow()
     issues = []
@@ -52,7 +60,7 @@ def check_backup_health(metrics: Dict) -> Dict:
             last_backup_time = datetime.fromisoformat(last_backup.replace("Z", "+00:00"))
             hours_since_backup = (now - last_backup_time.replace(tzinfo=None)).total_seconds() / 3600
             
-            if hours_since_backup > 48:  # No backup in 48 hours
+            if hours_since_backup > max_backup_age_hours:
                 issues.append(f"No backup in {hours_since_backup:.1f} hours")
         except Exception as e:
             issues.append(f"Invalid backup timestamp: {last_backup}")
@@ -124,15 +132,12 @@ def send_windows_notification(title: str, message: str) -> bool:
         logging.error(f"Failed to send Windows notification: {e}")
         return False
 
-def main():
-    """Main monitoring function"""
-    load_dotenv()
-    
-    logging.info("Starting backup health check...")
-    
-    metrics = load_metrics()
-    health = check_backup_health(metrics)
-    
+def get_max_backup_age_hours() -> float:
+    return float(os.getenv("MAX_BACKUP_AGE_HOURS", "48"))
+
+
+def report_health(health: Dict) -> None:
+    """Log/print the result of a health check and send alerts if unhealthy"""
     if health["healthy"]:
         logging.info("✅ Backup system is healthy")
         print("✅ All backup checks passed")
@@ -173,7 +178,120 @@ Please check the backup system immediately.
             "Backup System Alert", 
             f"{len(health['issues'])} issues detected. Check logs for details."
         )
-        
+
+
+def seconds_until_stale(metrics: Dict, max_backup_age_hours: float) -> Optional[float]:
+    """Seconds until the last backup exceeds max_backup_age_hours, or None if unknown/already stale"""
+    last_backup = metrics.get("last_backup")
+    if not last_backup:
+        return None
+    try:
+        last_backup_time = datetime.fromisoformat(last_backup.replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        return None
+    remaining = (last_backup_time + timedelta(hours=max_backup_age_hours) - datetime.utcnow()).total_seconds()
+    return remaining if remaining > 0 else None
+
+
+def watch_metrics(changed: threading.Event) -> Optional[object]:
+    """
+    Set `changed` whenever metrics.json is modified.
+
+    Uses watchdog (inotify/ReadDirectoryChangesW) when installed; otherwise
+    returns None and the caller falls back to polling the file's mtime.
+    """
+    try:
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+    except ImportError:
+        logging.warning("watchdog not installed - polling metrics.json instead (pip install watchdog)")
+        return None
+
+    target = METRICS_PATH.resolve()
+
+    class MetricsHandler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            paths = [getattr(event, "src_path", None), getattr(event, "dest_path", None)]
+            if any(p and Path(p).resolve() == target for p in paths):
+                changed.set()
+
+    observer = Observer()
+    observer.schedule(MetricsHandler(), str(target.parent), recursive=False)
+    observer.daemon = True
+    observer.start()
+    return observer
+
+
+def _metrics_mtime() -> Optional[int]:
+    try:
+        return METRICS_PATH.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def main_loop(poll_seconds: float = 5.0) -> None:
+    """
+    Long-running monitor: re-check health only when metrics.json changes, plus
+    a timer that fires when the last backup is due to become stale (or every
+    BACKUP_CHECK_INTERVAL_HOURS). Alerts are sent when the set of issues changes,
+    not on every check.
+    """
+    max_age = get_max_backup_age_hours()
+    interval = float(os.getenv("BACKUP_CHECK_INTERVAL_HOURS", "24")) * 3600
+    changed = threading.Event()
+    observer = watch_metrics(changed)
+    last_issues = None
+
+    logging.info("Starting backup monitor daemon (max backup age %.1f hours)...", max_age)
+    try:
+        while True:
+            # Reset the change markers before reading, so a write that lands
+            # while this check runs still wakes the wait below
+            changed.clear()
+            last_mtime = _metrics_mtime()
+            metrics = load_metrics()
+            health = check_backup_health(metrics, max_age)
+            issues = tuple(health["issues"])
+            if issues != last_issues:
+                report_health(health)
+                last_issues = issues
+
+            # Sleep until metrics.json changes or the next staleness deadline
+            timeout = seconds_until_stale(metrics, max_age)
+            timeout = min(timeout, interval) if timeout else interval
+            if observer is not None:
+                changed.wait(timeout)
+            else:
+                waited = 0.0
+                while waited < timeout and _metrics_mtime() == last_mtime:
+                    time.sleep(poll_seconds)
+                    waited += poll_seconds
+    except KeyboardInterrupt:
+        logging.info("Backup monitor stopped")
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
+
+
+def main():
+    """Main monitoring function"""
+    parser = argparse.ArgumentParser(description="Check backup health and send alerts")
+    parser.add_argument("--watch", action="store_true", help="run as a daemon instead of a single check")
+    args = parser.parse_args()
+
+    load_dotenv()
+
+    if args.watch:
+        main_loop()
+        return
+    
+    logging.info("Starting backup health check...")
+    
+    metrics = load_metrics()
+    health = check_backup_health(metrics, get_max_backup_age_hours())
+    report_health(health)
+    if not health["healthy"]:
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -1,19 +1,41 @@
+import atexit
 import logging
 import os
+import queue
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 from typing import Optional, Tuple
 
 from dotenv import load_dotenv
-from b2sdk.v2 import InMemoryAccountInfo, B2Api
+from b2sdk.v2 import B2HttpApiConfig, InMemoryAccountInfo, B2Api
+
+from backup_to_b2 import atomic_replace, make_http_session_factory
+
+try:
+    import pygit2
+except ImportError:  # optional, git add/commit fall back to the git CLI
+    pygit2 = None
+
+
+# Per-file messages are logged at DEBUG; INFO gets a progress line every N files
+PROGRESS_LOG_INTERVAL = 100
 
 
 def configure_logging() -> None:
+    # Records are written by a listener thread so worker threads never block on stderr
+    log_queue = queue.Queue(-1)
+    # The QueueHandler formats each record; the listener's handler writes it as-is
+    listener = QueueListener(log_queue, logging.StreamHandler())
+    listener.start()
+    atexit.register(listener.stop)
     logging.basicConfig(
         level=logging.INFO,
         format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[QueueHandler(log_queue)],
     )
 
 
@@ -29,11 +51,21 @@ def get_env(name: str, default: Optional[str] = None, required: bool = False) ->
     return value
 
 
-def init_b2() -> B2Api:
-    app_key_id = get_env("B2_APPLICATION_KEY_ID", required=True)
-    app_key = get_env("B2_APPLICATION_KEY", required=True)
+def get_restore_workers() -> int:
+    """Number of concurrent downloads (B2_RESTORE_WORKERS)"""
+    return max(1, int(os.getenv("B2_RESTORE_WORKERS", "16")))
+
+
+def init_b2(app_key_id: Optional[str] = None, app_key: Optional[str] = None) -> B2Api:
+    app_key_id = app_key_id or get_env("B2_APPLICATION_KEY_ID", required=True)
+    app_key = app_key or get_env("B2_APPLICATION_KEY", required=True)
     info = InMemoryAccountInfo()
-    b2_api = B2Api(info)
+    # One keep-alive connection per download worker; requests' default pool
+    # of 10 would discard and reopen TLS connections
+    b2_api = B2Api(
+        info,
+        api_config=B2HttpApiConfig(http_session_factory=make_http_session_factory(get_restore_workers())),
+    )
     logging.info("Authorizing against Backblaze B2...")
     b2_api.authorize_account("production", app_key_id, app_key)
     logging.info("Authorization successful.")
@@ -53,75 +85,67 @@ def ensure_directory(path: Path) -> None:
 
 def _iter_bucket_files(bucket, prefix: str):
     """
-    Yield file version-like objects for all files under the given prefix.
-    Works with both old and new b2sdk versions.
+    Yield file versions for the latest version of every file under the given prefix.
+    Prefix filtering is done server-side, up to 10,000 names per list call.
     """
     folder_name = (prefix or "").rstrip("/")
-    iterator = None
-    attempts = [
-        (folder_name,),                 # ls(folder_name)
-        (folder_name, False),           # ls(folder_name, show_versions=False) OR (folder_name, latest_only=False)
-        (folder_name, None, False),     # ls(folder_name, fetch_count=None, show_versions=False)
-    ]
-    last_err = None
-    for args in attempts:
-        try:
-            iterator = bucket.ls(*args)
-            break
-        except TypeError as e:
-            last_err = e
-            continue
-    if iterator is None:
-        # Fallback to listing root if everything else fails
-        try:
-            iterator = bucket.ls("")
-        except Exception:
-            # Re-raise the last TypeError for clarity
-            if last_err:
-                raise last_err
-            raise
-
-    for entry in iterator:
-        # Some versions return (file_version, folder)
-        if isinstance(entry, tuple):
-            file_version = entry[0]
-        else:
-            file_version = entry
-
-        # Skip folder entries
-        if getattr(file_version, "file_name", "").endswith("/"):
-            continue
-
-        # Apply prefix filter if needed
-        if prefix:
-            normalized = prefix.rstrip("/")
-            if not (
-                file_version.file_name == normalized
-                or file_version.file_name.startswith(normalized + "/")
-            ):
-                continue
-
+    for file_version, _ in bucket.ls(folder_name, latest_only=True, recursive=True, fetch_count=10000):
         yield file_version
 
 
+def decompress_zstd_file(path: Path) -> None:
+    """Decompress a zstd file in place (atomically replaces path)"""
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError(f"{path} is zstd-compressed in the backup - install with: pip install zstandard")
+    with atomic_replace(path) as tmp_path, open(path, "rb") as src, open(tmp_path, "wb") as dst:
+        zstandard.ZstdDecompressor().copy_stream(src, dst)
+
+
+def _download_file(bucket, file_name: str, local_path: Path, content_encoding: Optional[str] = None) -> None:
+    logging.debug("Downloading b2://%s/%s -> %s", bucket.name, file_name, local_path)
+    downloaded_file = bucket.download_file_by_name(file_name)
+    downloaded_file.save_to(str(local_path))
+    # Text assets may have been pre-compressed by backup_to_b2 (B2_COMPRESS_TEXT)
+    if content_encoding == "zstd":
+        decompress_zstd_file(local_path)
+
 
 def restore_prefix_to_local(bucket, prefix: str, site_dir: Path) -> int:
     """
-    Downloads all files under prefix to the local site_dir.
+    Downloads all files under prefix to the local site_dir concurrently.
     Returns number of files restored.
     """
     ensure_directory(site_dir)
-    count = 0
     logging.info("Listing files in bucket '%s' under prefix '%s/'", bucket.name, prefix)
+    downloads = []
     for file_version in _iter_bucket_files(bucket, prefix):
         relative = file_version.file_name[len(prefix):].lstrip("/")
-        local_path = site_dir / relative
-        ensure_directory(local_path.parent)
-        logging.info("Downloading b2://%s/%s -> %s", bucket.name, file_version.file_name, local_path)
-        downloader = bucket.download_file_by_name(file_version.file_name)
-        with open(local_path, "wb") as f:
-            downloader.save(f)
-        count += 1
+        content_encoding = (file_version.file_info or {}).get("content-encoding")
+        downloads.append((file_version.file_name, site_dir / relative, content_encoding))
+
+    # Create directories up front so workers never race on mkdir
+    for parent in {local_path.parent for _, local_path, _ in downloads}:
+        ensure_directory(parent)
+
+    count = 0
+    with ThreadPoolExecutor(max_workers=get_restore_workers()) as executor:
+        futures = [
+            executor.submit(_download_file, bucket, file_name, local_path, content_encoding)
+            for file_name, local_path, content_encoding in downloads
+        ]
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception:
+                # Fail fast: don't download the rest of the site first
+                for pending in futures:
+                    pending.cancel()
+                raise
+            count += 1
+            if count % PROGRESS_LOG_INTERVAL == 0:
+                logging.info("Downloaded %d/%d files", count, len(downloads))
     if count == 0:
         logging.warning("No files found for prefix '%s'.", prefix)
     else:
@@ -129,21 +153,59 @@ def restore_prefix_to_local(bucket, prefix: str, site_dir: Path) -> int:
     return count
 
 
-def run_git_commands(site_dir: Path, remote: str, branch: str) -> Tuple[int, str]:
+def _commit_with_pygit2(site_dir: Path, commit_message: str) -> bool:
+    """
+    Stage site_dir (including deletions) and commit it in-process via libgit2.
+    Returns False when the staged tree matches HEAD, i.e. nothing to commit.
+    """
+    repo_path = pygit2.discover_repository(os.getcwd())
+    if repo_path is None:
+        raise RuntimeError("Not inside a git repository")
+    repo = pygit2.Repository(repo_path)
+    pathspec = os.path.relpath(site_dir.resolve(), repo.workdir).replace(os.sep, "/")
+
+    index = repo.index
+    index.add_all([pathspec])
+    index.write()
+    tree = index.write_tree()
+
+    if repo.head_is_unborn:
+        parents = []
+    else:
+        head = repo.head.peel(pygit2.Commit)
+        if head.tree_id == tree:
+            return False
+        parents = [head.id]
+    signature = repo.default_signature
+    repo.create_commit("HEAD", signature, signature, commit_message, tree, parents)
+    return True
+
+
+def run_git_commands(site_dir: Path, remote: str, branch: str, commit_message: Optional[str] = None) -> Tuple[int, str]:
     """
     Adds the site_dir, commits changes, and pushes to the given remote/branch.
     Returns (exit_code, message).
+
+    With pygit2 installed, add + commit run in-process; the push always goes
+    through the git CLI so configured credential helpers keep working.
     """
-    try:
-        subprocess.run(["git", "add", str(site_dir)], check=True, capture_output=True)
-    except subprocess.CalledProcessError as e:
-        return e.returncode, e.stderr.decode(errors="ignore")
+    commit_message = commit_message or f"Restore site from Backblaze B2 on {datetime.utcnow().isoformat()}Z"
+    if pygit2 is not None:
+        try:
+            if not _commit_with_pygit2(site_dir, commit_message):
+                logging.info("No changes to commit.")
+        except Exception as e:
+            return 1, f"git commit failed: {e}"
+    else:
+        try:
+            subprocess.run(["git", "add", str(site_dir)], check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            return e.returncode, e.stderr.decode(errors="ignore")
 
-    commit_message = f"Restore site from Backblaze B2 on {datetime.utcnow().isoformat()}Z"
-    commit_proc = subprocess.run(["git", "commit", "-m", commit_message], capture_output=True)
-    if commit_proc.returncode != 0:
-        # Possibly "nothing to commit" – proceed to push anyway
-        logging.info(commit_proc.stderr.decode(errors="ignore").strip() or "No changes to commit.")
+        commit_proc = subprocess.run(["git", "commit", "-m", commit_message], capture_output=True)
+        if commit_proc.returncode != 0:
+            # Possibly "nothing to commit" – proceed to push anyway
+            logging.info(commit_proc.stderr.decode(errors="ignore").strip() or "No changes to commit.")
 
     push_proc = subprocess.run(["git", "push", remote, branch], capture_output=True)
     if push_proc.returncode != 0:
@@ -151,31 +213,54 @@ def run_git_commands(site_dir: Path, remote: str, branch: str) -> Tuple[int, str
     return 0, push_proc.stdout.decode(errors="ignore")
 
 
-def main() -> None:
-    configure_logging()
-    load_env()
+def restore_site_from_b2(*, load_env_vars: bool = True, bucket=None) -> int:
+    """
+    Restore the site from Backblaze B2 and redeploy it via git push.
 
-    bucket_name = get_env("B2_BUCKET_NAME", required=True)
-    prefix = get_env("B2_PREFIX", default="docs")
-    site_dir = Path(get_env("SITE_DIR", default="docs"))
-    git_remote = get_env("GIT_REMOTE", default="origin")
-    git_branch = get_env("GIT_BRANCH", default="main")
+    Raises instead of exiting so it can be called in-process (e.g. from server.py),
+    optionally with an already authorized bucket.
+    Returns the number of files restored.
+    """
+    if load_env_vars:
+        load_env()
 
-    try:
-        b2_api = init_b2()
+    if bucket is None:
+        bucket_name = os.getenv("B2_BUCKET_NAME")
+        if not bucket_name:
+            raise ValueError("B2_BUCKET_NAME is not set.")
+        app_key_id = os.getenv("B2_APPLICATION_KEY_ID")
+        if not app_key_id:
+            raise ValueError("B2_APPLICATION_KEY_ID is not set.")
+        app_key = os.getenv("B2_APPLICATION_KEY")
+        if not app_key:
+            raise ValueError("B2_APPLICATION_KEY is not set.")
+        b2_api = init_b2(app_key_id, app_key)
         bucket = ensure_bucket(b2_api, bucket_name)
-        restored = restore_prefix_to_local(bucket, prefix, site_dir)
-        if restored > 0:
-            logging.info("Redeploying to GitHub Pages via git push...")
-            code, msg = run_git_commands(site_dir, git_remote, git_branch)
-            if code != 0:
-                logging.error("Git push failed: %s", msg)
-                sys.exit(code or 1)
-            logging.info("Git push successful. Your GitHub Pages site should update shortly.")
-        else:
-            logging.warning("Nothing restored; skipping git deploy.")
-    except SystemExit:
-        raise
+
+    prefix = os.getenv("B2_PREFIX", "docs")
+    site_dir = Path(os.getenv("SITE_DIR", "docs"))
+    git_remote = os.getenv("GIT_REMOTE", "origin")
+    git_branch = os.getenv("GIT_BRANCH", "main")
+
+    restored = restore_prefix_to_local(bucket, prefix, site_dir)
+    if restored > 0:
+        logging.info("Redeploying to GitHub Pages via git push...")
+        code, msg = run_git_commands(site_dir, git_remote, git_branch)
+        if code != 0:
+            raise RuntimeError(f"Git push failed: {msg.strip()}")
+        logging.info("Git push successful. Your GitHub Pages site should update shortly.")
+    else:
+        logging.warning("Nothing restored; skipping git deploy.")
+    return restored
+
+
+def main() -> None:
+    configure_logging()
+    try:
+        restore_site_from_b2(load_env_vars=True)
+    except ValueError as exc:
+        logging.error("%s", exc)
+        sys.exit(2)
     except Exception as exc:
         logging.exception("Restore failed: %s", exc)
         sys.exit(1)
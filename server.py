@@ -1,123 +1,289 @@
-import json
+import atexit
+import hmac
 import logging
 import os
+import queue
 import shutil
-import subprocess
-import sys
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
-from functools import wraps
+from functools import lru_cache, wraps
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 
+import orjson
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request, send_from_directory,render_template
+from flask import Flask, jsonify, request, send_file, send_from_directory,render_template
+from flask_caching import Cache
 
-from backup_to_b2 import backup_site_to_b2
+from b2_client import get_bucket
+from backup_to_b2 import atomic_write_bytes, backup_site_to_b2
+from restore_from_b2 import restore_site_from_b2
 
 
 ROOT = Path(__file__).resolve().parent
 SITE_DIR = ROOT / "docs"
 CONTENT_PATH = SITE_DIR / "data" / "content.json"
 METRICS_PATH = ROOT / "metrics.json"
+LOG_PATH = ROOT / "backup.log"
 BACKUP_DIR = ROOT / "backup_temp"
 
+# Seconds the dashboard polling routes (/metrics, /admin/logs) are cached for
+POLL_CACHE_TIMEOUT = 2
+
+# Bytes read from the end of backup.log for /admin/logs
+LOG_TAIL_BYTES = 8192
+
+# Seconds to wait after a metrics update before writing metrics.json
+METRICS_FLUSH_DELAY = 5.0
+
+DEFAULT_METRICS = {
+    "last_backup": "—",
+    "last_restore": "—",
+    "backup_status": "Idle",
+    "total_files": 0
+}
+
+# Whether docs/index.html exists. Kept up to date by the routes that change
+# SITE_DIR, and rechecked while offline in case the site is restored externally.
+_SITE_READY = False
+
+# In-memory metrics, loaded from disk once and flushed back when dirty
+_METRICS = None
+_METRICS_LOCK = threading.Lock()
+_DIRTY = False
+_FLUSH_TIMER = None
+# Bumped on every update; with the boot id it forms the /metrics ETag
+_METRICS_VERSION = 0
+_BOOT_ID = time.time_ns()
+
 load_dotenv(override=False)
 
-# Configure logging
+# Configure logging: request threads format and enqueue records; a listener
+# thread does the file/console writes
+_log_queue = queue.Queue(-1)
+_log_listener = QueueListener(
+    _log_queue,
+    logging.FileHandler(LOG_PATH),
+    logging.StreamHandler()
+)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(ROOT / "backup.log"),
-        logging.StreamHandler()
-    ]
+    handlers=[QueueHandler(_log_queue)]
 )
 
 app = Flask(__name__)
+# Templates only change on deploy; don't stat them on every render
+app.config["TEMPLATES_AUTO_RELOAD"] = False
+# Let a fronting web server (nginx X-Accel / Apache mod_xsendfile) stream site files
+# with sendfile(2) instead of Python; only enable when such a server is in front
+app.config["USE_X_SENDFILE"] = (os.getenv("USE_X_SENDFILE") or "").strip().lower() in ("1", "true", "yes", "on")
+# In-process cache; a multi-worker deployment needs a shared backend such as RedisCache
+cache = Cache(app, config={"CACHE_TYPE": "SimpleCache"})
+
+# Read once at startup (after load_dotenv); compared as bytes in constant time
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+ADMIN_TOKEN_BYTES = ADMIN_TOKEN.encode() if ADMIN_TOKEN else None
+if ADMIN_TOKEN_BYTES is None:
+    logging.warning("No ADMIN_TOKEN set - authentication disabled")
 
 # Authentication decorator
 def require_auth(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        auth_token = os.getenv("ADMIN_TOKEN")
-        if not auth_token:
-            logging.warning("No ADMIN_TOKEN set - authentication disabled")
+        if ADMIN_TOKEN_BYTES is None:
             return f(*args, **kwargs)
         
         # Check Authorization header
-        auth_header = request.headers.get("Authorization")
-        if not auth_header or not auth_header.startswith("Bearer "):
+        scheme, _, token = (request.headers.get("Authorization") or "").partition(" ")
+        if scheme != "Bearer" or not token:
             return jsonify({"status": "error", "message": "Authentication required"}), 401
         
-        token = auth_header.split(" ", 1)[1]
-        if token != auth_token:
+        if not hmac.compare_digest(token.encode(), ADMIN_TOKEN_BYTES):
             return jsonify({"status": "error", "message": "Invalid token"}), 401
         
         return f(*args, **kwargs)
     return decorated_function
 
 # Metrics tracking
+def _load_metrics():
+    """Return the in-memory metrics dict, reading metrics.json on first use (caller holds _METRICS_LOCK)"""
+    global _METRICS
+    if _METRICS is None:
+        metrics = {}
+        if METRICS_PATH.exists():
+            metrics = orjson.loads(METRICS_PATH.read_bytes())
+        _METRICS = metrics
+    return _METRICS
+
+
+def _flush_metrics():
+    """Write the in-memory metrics to metrics.json if they changed since the last flush"""
+    global _DIRTY, _FLUSH_TIMER
+    with _METRICS_LOCK:
+        _FLUSH_TIMER = None
+        if not _DIRTY:
+            return
+        try:
+            atomic_write_bytes(METRICS_PATH, orjson.dumps(_METRICS))
+            _DIRTY = False
+        except Exception as e:
+            logging.error(f"Failed to write metrics: {e}")
+
+
+atexit.register(_flush_metrics)
+
+
 def update_metrics(operation, status="success", files_count=0, error_msg=None):
     """Update backup/restore metrics"""
+    global _DIRTY, _FLUSH_TIMER, _METRICS_VERSION
     try:
-        metrics = {}
-        if METRICS_PATH.exists():
-            with open(METRICS_PATH, "r") as f:
-                metrics = json.load(f)
-        
-        timestamp = datetime.utcnow().isoformat() + "Z"
-        metrics[f"last_{operation}"] = timestamp
-        metrics[f"{operation}_status"] = status
-        if files_count > 0:
-            metrics["total_files"] = files_count
-        if error_msg:
-            metrics[f"last_{operation}_error"] = error_msg
-        
-        with open(METRICS_PATH, "w") as f:
-            json.dump(metrics, f, indent=2)
-        
+        with _METRICS_LOCK:
+            metrics = _load_metrics()
+
+            timestamp = datetime.utcnow().isoformat() + "Z"
+            metrics[f"last_{operation}"] = timestamp
+            metrics[f"{operation}_status"] = status
+            if files_count > 0:
+                metrics["total_files"] = files_count
+            if error_msg:
+                metrics[f"last_{operation}_error"] = error_msg
+
+            _DIRTY = True
+            _METRICS_VERSION += 1
+            if _FLUSH_TIMER is None:
+                _FLUSH_TIMER = threading.Timer(METRICS_FLUSH_DELAY, _flush_metrics)
+                _FLUSH_TIMER.daemon = True
+                _FLUSH_TIMER.start()
+
         logging.info(f"Updated metrics: {operation} {status}, files: {files_count}")
     except Exception as e:
         logging.error(f"Failed to update metrics: {e}")
 
 
-def run_script(script_name: str):
-    """Execute a Python script and return (ok, message)."""
+def _file_tag(*paths):
+    """Cheap version string for files/dirs from their mtime and size"""
+    parts = []
+    for path in paths:
+        try:
+            st = path.stat()
+            parts.append(f"{st.st_mtime_ns:x}-{st.st_size:x}")
+        except FileNotFoundError:
+            parts.append("none")
+    return "-".join(parts)
+
+
+def _metrics_tag():
+    return f"{_BOOT_ID:x}-{_METRICS_VERSION}"
+
+
+def _logs_tag():
+    return _file_tag(LOG_PATH)
+
+
+def _health_tag():
+    return _file_tag(SITE_DIR, CONTENT_PATH)
+
+
+def conditional_etag(compute_tag):
+    """Answer If-None-Match with 304 when compute_tag() is unchanged, otherwise tag the 200 response"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            etag = compute_tag()
+            if request.if_none_match.contains(etag):
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "max-age=1"
+            return response
+        return decorated_function
+    return decorator
+
+
+class LogCapture(logging.Handler):
+    """Collect formatted log records emitted while an operation runs"""
+
+    def __init__(self):
+        super().__init__(level=logging.INFO)
+        self.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+@contextmanager
+def capture_logs():
+    handler = LogCapture()
+    root_logger = logging.getLogger()
+    root_logger.addHandler(handler)
     try:
-        completed = subprocess.run(
-            [sys.executable, str(ROOT / script_name)],
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-        output = (
-            completed.stdout.strip()
-            or completed.stderr.strip()
-            or "Operation completed."
-        )
-        return True, output
-    except subprocess.CalledProcessError as exc:
-        err = exc.stderr.strip() or exc.stdout.strip() or "Unknown error."
-        return False, err
+        yield handler
+    finally:
+        root_logger.removeHandler(handler)
+
+
+def run_operation(operation, default_message: str = "Operation completed."):
+    """Run operation() in-process and return (ok, result, message) with its log output as message."""
+    with capture_logs() as logs:
+        try:
+            result = operation()
+            ok = True
+        except Exception as exc:
+            logging.exception("Operation failed: %s", exc)
+            result = None
+            ok = False
+    message = "\n".join(logs.lines).strip()
+    return ok, result, message or (default_message if ok else "Unknown error.")
 
 
 
 @app.route("/admin/logs")
+@conditional_etag(_logs_tag)
+@cache.cached(timeout=POLL_CACHE_TIMEOUT, key_prefix=lambda: f"logs/{_logs_tag()}")
 def admin_logs():
     """Get recent log entries"""
     try:
-        log_path = ROOT / "backup.log"
+        log_path = LOG_PATH
         if not log_path.exists():
             return jsonify({"logs": ["No logs available"]})
         
-        with open(log_path, "r") as f:
-            lines = f.readlines()
-            # Get last 20 lines
-            recent_logs = lines[-20:] if len(lines) > 20 else lines
-            return jsonify({"logs": [line.strip() for line in recent_logs]})
+        # Only read the end of the file; it has the last 20 lines unless they are very long
+        size = log_path.stat().st_size
+        offset = max(0, size - LOG_TAIL_BYTES)
+        with open(log_path, "rb") as f:
+            f.seek(offset)
+            lines = f.read().decode("utf-8", "replace").splitlines()
+        if offset:
+            # Drop the partial line the seek landed in
+            lines = lines[1:]
+        return jsonify({"logs": [line.strip() for line in lines[-20:]]})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def _refresh_site_ready():
+    """Re-check whether the site can be served and return the result"""
+    global _SITE_READY
+    _SITE_READY = SITE_DIR.is_dir() and (SITE_DIR / "index.html").exists()
+    return _SITE_READY
+
+
+def site_ready():
+    return _SITE_READY or _refresh_site_ready()
+
+
+_refresh_site_ready()
+
+
 # ============================================================================
 # ROUTES: User Website (served from /docs)
 # ============================================================================
@@ -125,7 +291,7 @@ def admin_logs():
 @app.route("/")
 def root():
     """Serve the main user website or redirect to admin if docs doesn't exist"""
-    if not SITE_DIR.exists() or not (SITE_DIR / "index.html").exists():
+    if not site_ready():
         return f'''
         <!DOCTYPE html>
         <html>
@@ -139,7 +305,16 @@ def root():
         </body>
         </html>
         '''
-    return send_from_directory(str(SITE_DIR), "index.html")
+    return send_from_directory(str(SITE_DIR), "index.html", conditional=True)
+
+
+@lru_cache(maxsize=2048)
+def _resolve(filename):
+    """Resolve a request path to an absolute path inside SITE_DIR, or None if it escapes it"""
+    full_path = (SITE_DIR / filename).resolve()
+    if not full_path.is_relative_to(SITE_DIR.resolve()):
+        return None
+    return full_path
 
 
 @app.route("/<path:filename>")
@@ -149,20 +324,30 @@ def serve_static(filename):
     if filename.startswith('admin'):
         return jsonify({"error": "Not found"}), 404
     
-    if not SITE_DIR.exists():
+    if not site_ready():
         return jsonify({"error": "Site files not available. Visit /admin to restore."}), 404
     
+    full_path = _resolve(filename)
+    if full_path is None:
+        return jsonify({"error": "File not found"}), 404
     try:
-        return send_from_directory(str(SITE_DIR), filename)
-    except:
+        return send_file(full_path, conditional=True)
+    except OSError:
+        # Missing file or a directory
         return jsonify({"error": "File not found"}), 404
 
 
+@lru_cache(maxsize=None)
+def _render_admin_dashboard(site_status):
+    """Render the admin page once per site status (the only thing that varies)"""
+    return render_template('admin_dashboard.html', site_status=site_status)
+
+
 @app.route("/admin")
 def admin_dashboard():
     """Serve the admin control panel"""
-    site_status = "✅ Online" if (SITE_DIR.exists() and (SITE_DIR / "index.html").exists()) else "🚨 Offline"
-    return render_template('admin_dashboard.html', site_status=site_status)
+    site_status = "✅ Online" if site_ready() else "🚨 Offline"
+    return _render_admin_dashboard(site_status)
 
 
 @app.route("/save-content", methods=["POST"])
@@ -176,16 +361,15 @@ def save_content():
 
     try:
         CONTENT_PATH.parent.mkdir(parents=True, exist_ok=True)
-        with CONTENT_PATH.open("w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
+        atomic_write_bytes(CONTENT_PATH, orjson.dumps(data, option=orjson.OPT_INDENT_2))
     except Exception as exc:  # pragma: no cover - defensive
         return jsonify({"status": "error", "message": f"Failed to write file: {exc}"}), 500
 
     try:
-        files_uploaded = backup_site_to_b2(load_env_vars=False)
-        update_metrics("backup", "success", files_uploaded)
+        result = backup_site_to_b2(load_env_vars=False, bucket=get_bucket())
+        update_metrics("backup", "success", result.total)
         message = "Changes saved and backed up to cloud successfully!"
-        if files_uploaded == 0:
+        if result.uploaded == 0:
             message += " (No files changed since last backup.)"
         return jsonify({"status": "success", "message": message})
     except Exception as exc:
@@ -205,10 +389,10 @@ def save_content():
 @app.route("/backup", methods=["POST"])
 @require_auth
 def trigger_backup():
-    ok, message = run_script("backup_to_b2.py")
+    ok, result, message = run_operation(lambda: backup_site_to_b2(load_env_vars=False, bucket=get_bucket()))
     status = "success" if ok else "error"
     if ok:
-        update_metrics("backup", "success")
+        update_metrics("backup", "success", result.total)
     else:
         update_metrics("backup", "error", 0, message)
     return jsonify({"status": status, "message": message}), (200 if ok else 500)
@@ -217,7 +401,9 @@ def trigger_backup():
 @app.route("/restore", methods=["POST"])
 @require_auth
 def trigger_restore():
-    ok, message = run_script("restore_from_b2.py")
+    ok, _, message = run_operation(lambda: restore_site_from_b2(load_env_vars=False, bucket=get_bucket()))
+    _resolve.cache_clear()
+    _refresh_site_ready()
     status = "success" if ok else "error"
     if ok:
         update_metrics("restore", "success")
@@ -230,24 +416,30 @@ def trigger_restore():
 @require_auth
 def simulate_disaster():
     """Simulate a disaster by backing up and then removing the docs directory"""
+    global _SITE_READY
     try:
         # First, ensure we have a recent backup
         logging.info("Creating safety backup before disaster simulation...")
-        files_uploaded = backup_site_to_b2(load_env_vars=False)
+        result = backup_site_to_b2(load_env_vars=False, bucket=get_bucket())
+        update_metrics("backup", "success", result.total)
         
         # Create local backup
         if BACKUP_DIR.exists():
             shutil.rmtree(BACKUP_DIR)
-        shutil.copytree(SITE_DIR, BACKUP_DIR)
+        # copytree walks with os.scandir; copyfile uses sendfile() on Linux and
+        # skips copy2's per-file copystat (stat + utime + chmod) calls
+        shutil.copytree(SITE_DIR, BACKUP_DIR, copy_function=shutil.copyfile)
         
         # Simulate disaster - remove docs directory
         logging.warning("SIMULATING DISASTER: Removing docs directory")
         shutil.rmtree(SITE_DIR)
+        _SITE_READY = False
+        _resolve.cache_clear()
         
         update_metrics("disaster", "simulated")
         return jsonify({
             "status": "success", 
-            "message": f"🚨 Disaster simulated! Docs directory removed. {files_uploaded} files were backed up to cloud. Use Restore to recover."
+            "message": f"🚨 Disaster simulated! Docs directory removed. {result.total} files are backed up to cloud ({result.uploaded} uploaded just now). Use Restore to recover."
         })
     except Exception as exc:
         logging.exception("Failed to simulate disaster")
@@ -257,25 +449,20 @@ def simulate_disaster():
         }), 500
 
 @app.route("/metrics", methods=["GET"])
+@conditional_etag(_metrics_tag)
+@cache.cached(timeout=POLL_CACHE_TIMEOUT, key_prefix=lambda: f"metrics/{_metrics_tag()}")
 def get_metrics():
     """Get backup/restore metrics"""
     try:
-        if METRICS_PATH.exists():
-            with open(METRICS_PATH, "r") as f:
-                metrics = json.load(f)
-        else:
-            metrics = {
-                "last_backup": "—",
-                "last_restore": "—",
-                "backup_status": "Idle",
-                "total_files": 0
-            }
+        with _METRICS_LOCK:
+            metrics = dict(_load_metrics() or DEFAULT_METRICS)
         return jsonify(metrics)
     except Exception as exc:
         logging.exception("Failed to get metrics")
         return jsonify({"error": str(exc)}), 500
 
 @app.route("/health", methods=["GET"])
+@conditional_etag(_health_tag)
 def health_check():
     """Health check endpoint"""
     return jsonify({
@@ -291,7 +478,8 @@ if __name__ == "__main__":
     CONTENT_PATH.parent.mkdir(parents=True, exist_ok=True)
     
     logging.info("Starting Automated Cloud Backup server...")
-    app.run(debug=True, use_reloader=False)
+    # Threaded dev server as a fallback; use wsgi.py with gunicorn in production
+    app.run(debug=False, threaded=True, use_reloader=False)
 
 
 
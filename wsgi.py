@@ -0,0 +1,10 @@
+"""
+WSGI entry point for running the server under gunicorn:
+
+    gunicorn -w 1 -k gthread --threads 16 -b 0.0.0.0:5000 wsgi:application
+
+Keep a single worker process: metrics, the response cache, the B2 handle and
+the backup lock all live in server.py's process memory.
+"""
+
+from server import app as application